@@ -1,9 +1,13 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import time
 from pathlib import Path
 from typing import Optional
 
+import requests
+from requests.adapters import HTTPAdapter
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 import cv2
@@ -16,6 +20,14 @@ except ImportError:  # pragma: no cover
 
 logger = logging.getLogger(__name__)
 
+# Webhook 送信は keep-alive を効かせるためセッションを使い回す
+_webhook_session = requests.Session()
+_webhook_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+
+SLACK_QUEUE_MAXSIZE = 64
+# 同一メッセージはこの秒数内なら再送しない
+SLACK_DEDUPE_SECONDS = 30.0
+
 
 def send_slack_alert(
     bot_token: str,
@@ -42,14 +54,42 @@ def send_slack_alert(
             # fallback to text via webhook if provided
 
     if webhook_url:
-        import requests
-
         try:
-            requests.post(webhook_url, json={"text": message}, timeout=5)
+            _webhook_session.post(webhook_url, json={"text": message}, timeout=5)
         except Exception as exc:  # pragma: no cover
             logger.error("Slack webhook failed: %s", exc)
 
 
+def enqueue_slack_alert(queue: asyncio.Queue, **alert) -> bool:
+    """send_slack_alert の引数をキューへ積む。満杯の場合は破棄する。"""
+    try:
+        queue.put_nowait(alert)
+    except asyncio.QueueFull:
+        logger.warning("Slack alert queue full; dropping alert")
+        return False
+    return True
+
+
+async def slack_worker(queue: asyncio.Queue, dedupe_seconds: float = SLACK_DEDUPE_SECONDS) -> None:
+    """キューの通知を1件ずつイベントループ外で送信する。"""
+    last_sent: dict[str, float] = {}
+    while True:
+        alert = await queue.get()
+        try:
+            now = time.monotonic()
+            message = alert.get("message", "")
+            last = last_sent.get(message)
+            if last is not None and now - last < dedupe_seconds:
+                continue
+            last_sent = {key: ts for key, ts in last_sent.items() if now - ts < dedupe_seconds}
+            last_sent[message] = now
+            await asyncio.to_thread(send_slack_alert, **alert)
+        except Exception as exc:  # pragma: no cover
+            logger.error("Slack alert worker failed: %s", exc)
+        finally:
+            queue.task_done()
+
+
 def gpio_setup(pin: int) -> None:
     if GPIO is None:
         return
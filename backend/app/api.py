@@ -1,17 +1,20 @@
 from __future__ import annotations
 
-from datetime import datetime, timezone
+import os
 from pathlib import Path
 from typing import Optional
 import json
 
+import aiofiles
+import orjson
+
 from fastapi import APIRouter, FastAPI, Request, HTTPException, UploadFile, File
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, ORJSONResponse, Response
 from pydantic import BaseModel, Field
 
-from .config import Settings, get_settings_path, load_settings, get_mask_path
+from .config import Settings, get_mask_path
 from .alert import gpio_low
-from .storage import list_recent_images
+from .storage import is_overlay, iso_from_mtime_ns, list_recent_image_entries
 
 
 class ConfigRequest(BaseModel):
@@ -29,6 +32,7 @@ class ConfigRequest(BaseModel):
     slack_channel: Optional[str] = None
     mask_inclusive: Optional[bool] = None
     gpio_pin: Optional[int] = None
+    analysis_max_width: Optional[int] = Field(default=None, ge=0)
 
 
 class ControlRequest(BaseModel):
@@ -39,40 +43,44 @@ class ControlRequest(BaseModel):
 
 router = APIRouter()
 
+UPLOAD_CHUNK_SIZE = 1 << 20
+
 
 def save_settings(path: Path, settings: Settings) -> None:
-    path.write_text(settings.model_dump_json(indent=2))
+    path.write_bytes(orjson.dumps(settings.model_dump(mode="json"), option=orjson.OPT_INDENT_2))
+
+
+async def _apply_settings_update(request: Request, data: dict) -> tuple[Settings, Settings]:
+    """app.state.settings を正として更新し、ファイルへ書き出してから差し替える。"""
+    state = request.app.state
+    async with state.settings_lock:  # type: ignore
+        settings: Settings = state.settings  # type: ignore
+        new_settings = settings.model_copy(update=data)
+        save_settings(state.settings_path, new_settings)  # type: ignore
+        state.settings = new_settings  # type: ignore
+    return settings, new_settings
 
 
 @router.post("/config")
 async def update_config(payload: ConfigRequest, request: Request):
-    settings_path = get_settings_path()
-    settings = load_settings(settings_path)
     data = payload.model_dump(exclude_none=True)
-    new_settings = settings.model_copy(update=data)
-    save_settings(settings_path, new_settings)
-    request.app.state.settings = new_settings  # type: ignore
+    _, new_settings = await _apply_settings_update(request, data)
     return {"ok": True, "settings": new_settings}
 
 
 @router.get("/config")
-async def get_config():
-    settings_path = get_settings_path()
-    settings = load_settings(settings_path)
+async def get_config(request: Request):
+    settings: Settings = request.app.state.settings  # type: ignore
     return {"settings": settings}
 
 
 @router.post("/control")
 async def control(payload: ControlRequest, request: Request):
-    settings_path = get_settings_path()
-    settings = load_settings(settings_path)
     data = payload.model_dump(exclude_none=True)
     reset_alarm = data.pop("reset_alarm", False)
-    new_settings = settings.model_copy(update=data)
-    save_settings(settings_path, new_settings)
+    settings, new_settings = await _apply_settings_update(request, data)
     if reset_alarm and settings.gpio_pin:
         gpio_low(settings.gpio_pin)
-    request.app.state.settings = new_settings  # type: ignore
     return {"ok": True, "settings": new_settings}
 
 
@@ -83,38 +91,47 @@ async def history(
     request: Request = None,
 ):
     storage_root = request.app.state.storage_root  # type: ignore
-    files = list_recent_images(storage_root, limit=limit * 3, include_overlays=not exclude_overlay)  # extra fetch to filter overlays
-    items = []
-    for p in files:
-        name = p.name
-        is_overlay = "mask" in name and name.endswith(".png")
-        if exclude_overlay and is_overlay:
-            continue
-        try:
-            mtime = datetime.fromtimestamp(p.stat().st_mtime, tz=timezone.utc).isoformat()
-        except OSError:
-            mtime = None
-        items.append({"path": str(p), "mtime": mtime, "is_overlay": is_overlay})
-        if len(items) >= limit:
-            break
-    return {"images": items, "limit": limit, "exclude_overlay": exclude_overlay}
+    entries = list_recent_image_entries(
+        storage_root,
+        limit=limit,
+        include_overlays=not exclude_overlay,
+        recent=request.app.state.recent_images,  # type: ignore
+    )
+    # オーバーレイの判定は走査側と同じ is_overlay を使い、除外時は走査結果をそのまま返す
+    items = [
+        {"path": str(p), "mtime": iso_from_mtime_ns(mtime_ns), "is_overlay": is_overlay(p)}
+        for mtime_ns, p in entries
+    ]
+    return ORJSONResponse({"images": items, "limit": limit, "exclude_overlay": exclude_overlay})
 
 
 @router.get("/mask-image")
-async def get_mask_image():
+async def get_mask_image(request: Request):
     mask_path = get_mask_path()
-    if not mask_path.exists():
+    try:
+        stat = mask_path.stat()
+    except OSError:
         raise HTTPException(status_code=404, detail="mask not found")
-    return FileResponse(mask_path)
+    etag = f'"{stat.st_mtime_ns:x}"'
+    # フロントは削除後も同じ URL で存在確認するため、キャッシュは毎回 ETag で再検証させる
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(mask_path, headers=headers, stat_result=stat)
 
 
 @router.post("/mask-image")
 async def upload_mask_image(file: UploadFile = File(...)):
     mask_path = get_mask_path()
+    # 全体をメモリに載せずチャンク単位で書き出し、完了後に置き換える
+    tmp_path = mask_path.with_name(mask_path.name + ".uploading")
     try:
-        content = await file.read()
-        mask_path.write_bytes(content)
+        async with aiofiles.open(tmp_path, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await out.write(chunk)
+        os.replace(tmp_path, mask_path)
     except Exception as exc:
+        tmp_path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"failed to save mask: {exc}")
     return {"ok": True}
 
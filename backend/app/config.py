@@ -1,10 +1,10 @@
 from __future__ import annotations
 
-import json
 import os
 from pathlib import Path
 from typing import Optional
 
+import orjson
 from pydantic import BaseModel, Field, ValidationError
 
 
@@ -23,14 +23,16 @@ class Settings(BaseModel):
     slack_channel: str = ""
     mask_inclusive: bool = True
     gpio_pin: Optional[int] = 17
+    # 検知処理を行う最大幅(px)。0 でフル解像度のまま処理する
+    analysis_max_width: int = Field(640, ge=0)
 
 
 def load_settings(path: Path) -> Settings:
     try:
-        raw = json.loads(path.read_text())
+        raw = orjson.loads(path.read_bytes())
     except FileNotFoundError as exc:
         raise FileNotFoundError(f"settings file not found: {path}") from exc
-    except json.JSONDecodeError as exc:
+    except orjson.JSONDecodeError as exc:
         raise ValueError(f"invalid JSON in settings file: {path}") from exc
 
     try:
@@ -62,3 +64,8 @@ def get_incoming_root() -> Path:
 def get_logs_root() -> Path:
     env_path = os.getenv("LOG_ROOT")
     return Path(env_path) if env_path else Path("./logs")
+
+
+def get_motion_backend() -> str:
+    # auto / numba / opencv
+    return os.getenv("MOTION_BACKEND", "auto").strip().lower()
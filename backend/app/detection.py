@@ -1,15 +1,25 @@
 from __future__ import annotations
 
+import functools
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable, List, Optional
+from typing import Dict, Iterable, List, Optional
 
 import cv2
 import numpy as np
 import re
 
+from . import motion_kernel
 from .config import Settings
 
+_MORPH_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+_DEFAULT_OVERLAY_COLOR = (255, 105, 180)
+_DEFAULT_OVERLAY_ALPHA = 0.35
+# フレーム形状ごとに保持する作業バッファの形状数の上限
+_MAX_BUFFER_SHAPES = 4
+
+FrameBuffers = Dict[tuple[int, int], Dict[str, np.ndarray]]
+
 
 @dataclass
 class DetectionResult:
@@ -18,6 +28,8 @@ class DetectionResult:
     mask_pixels: int
     overlay_path: Optional[Path]
     alarm: bool
+    # overlay_path へ未書き込みのオーバーレイ画像。書き込みは write_overlay で行う
+    overlay_image: Optional[np.ndarray] = None
 
 
 def _read_image(path: Path) -> Optional[np.ndarray]:
@@ -45,28 +57,90 @@ def _load_mask_image(mask_path: Path, target_shape: tuple[int, int], inclusive:
     return mask_bin
 
 
+@functools.lru_cache(maxsize=4)
+def _cached_mask(mask_path_str: str, mtime_ns: int, target_shape: tuple[int, int], inclusive: bool) -> np.ndarray:
+    # mtime_ns をキーに含め、マスク更新時のみ再デコードする。共有するため読み取り専用にする
+    mask = _load_mask_image(Path(mask_path_str), target_shape, inclusive)
+    mask.setflags(write=False)
+    return mask
+
+
 def _ensure_odd(value: int) -> int:
     return value if value % 2 == 1 else value + 1
 
 
-def _resize_if_needed(img: np.ndarray, target_shape: tuple[int, int]) -> np.ndarray:
+def _resize_if_needed(
+    img: np.ndarray,
+    target_shape: tuple[int, int],
+    buffers: Optional[Dict[str, np.ndarray]] = None,
+    name: str = "",
+) -> np.ndarray:
     if img.shape[:2] == target_shape:
         return img
-    return cv2.resize(img, (target_shape[1], target_shape[0]), interpolation=cv2.INTER_LINEAR)
+    shrinking = target_shape[0] * target_shape[1] < img.shape[0] * img.shape[1]
+    interpolation = cv2.INTER_AREA if shrinking else cv2.INTER_LINEAR
+    dst = _buffer(buffers, name, target_shape + img.shape[2:])
+    return cv2.resize(img, (target_shape[1], target_shape[0]), dst=dst, interpolation=interpolation)
 
 
-def _overlay(image: np.ndarray, mask: np.ndarray, color=(255, 105, 180), alpha: float = 0.35) -> np.ndarray:
+def _shape_buffers(frame_buffers: Optional[FrameBuffers], shape: tuple[int, int]) -> Optional[Dict[str, np.ndarray]]:
+    if frame_buffers is None:
+        return None
+    buffers = frame_buffers.get(shape)
+    if buffers is None:
+        if len(frame_buffers) >= _MAX_BUFFER_SHAPES:
+            frame_buffers.clear()
+        buffers = frame_buffers[shape] = {}
+    return buffers
+
+
+def _buffer(
+    buffers: Optional[Dict[str, np.ndarray]], name: str, shape: tuple[int, ...], dtype=np.uint8
+) -> Optional[np.ndarray]:
+    # buffers が無い場合は None を返し、OpenCV 側で新規確保させる
+    if buffers is None:
+        return None
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype=dtype)
+    return buf
+
+
+def _analysis_shape(shape: tuple[int, int], max_width: int) -> tuple[int, int]:
+    height, width = shape
+    if max_width <= 0 or width <= max_width:
+        return shape
+    scale = max_width / width
+    return (max(1, round(height * scale)), max_width)
+
+
+@functools.lru_cache(maxsize=4)
+def _color_layer(shape: tuple[int, ...], color: tuple[int, int, int]) -> np.ndarray:
+    layer = np.empty(shape, dtype=np.uint8)
+    layer[...] = color
+    layer.setflags(write=False)
+    return layer
+
+
+def _overlay(
+    image: np.ndarray,
+    mask: np.ndarray,
+    color=_DEFAULT_OVERLAY_COLOR,
+    alpha: float = _DEFAULT_OVERLAY_ALPHA,
+    blended: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    # float32 への変換を避け、uint8 のまま合成してからマスク部分のみ書き戻す
+    blended = cv2.addWeighted(
+        image, 1 - alpha, _color_layer(image.shape, tuple(color)), alpha, 0.0, dst=blended
+    )
+    # 戻り値は書き込みスレッドへ渡すため、作業バッファと共有せず毎回確保する
     overlay_img = image.copy()
-    mask_bool = mask > 0
-    color_arr = np.array(color, dtype=np.uint8)
-    overlay_img[mask_bool] = (
-        overlay_img[mask_bool].astype(np.float32) * (1 - alpha)
-        + color_arr.astype(np.float32) * alpha
-    ).astype(np.uint8)
+    cv2.copyTo(blended, mask, dst=overlay_img)
     return overlay_img
 
 
-def _parse_overlay_color(color_str: str, fallback=(255, 105, 180)) -> tuple[int, int, int]:
+@functools.lru_cache(maxsize=16)
+def _parse_overlay_color(color_str: str, fallback=_DEFAULT_OVERLAY_COLOR) -> tuple[int, int, int]:
     if isinstance(color_str, str) and len(color_str) == 7 and color_str.startswith("#"):
         try:
             r = int(color_str[1:3], 16)
@@ -78,7 +152,8 @@ def _parse_overlay_color(color_str: str, fallback=(255, 105, 180)) -> tuple[int,
     return fallback
 
 
-def _parse_overlay_alpha(alpha_val: float, fallback=0.35) -> float:
+@functools.lru_cache(maxsize=16)
+def _parse_overlay_alpha(alpha_val: float, fallback=_DEFAULT_OVERLAY_ALPHA) -> float:
     try:
         a = float(alpha_val)
         if 0 <= a <= 1:
@@ -95,46 +170,104 @@ def _overlay_path(latest_path: Path) -> Path:
     return latest_path.with_name(f"{stem}_mask.png")
 
 
+def write_overlay(overlay_path: Path, overlay_img: np.ndarray) -> bool:
+    # 圧縮レベル1（既定3）でエンコード時間を短縮する
+    return bool(cv2.imwrite(str(overlay_path), overlay_img, [cv2.IMWRITE_PNG_COMPRESSION, 1]))
+
+
 def analyze_detection(
     latest_path: Path,
     previous_path: Path,
     settings: Settings,
     mask_path: Path,
+    frame_buffers: Optional[FrameBuffers] = None,
 ) -> Optional[DetectionResult]:
+    """frame_buffers を渡すと、中間配列をフレーム形状ごとに使い回す（同時呼び出しは不可）。"""
     img_latest = _read_image(latest_path)
     img_prev = _read_image(previous_path)
     if img_latest is None or img_prev is None:
         return None
 
-    img_prev = _resize_if_needed(img_prev, img_latest.shape[:2])
+    # 検知は縮小した解像度で行い、オーバーレイ合成時のみ元解像度へ戻す
+    analysis_shape = _analysis_shape(img_latest.shape[:2], settings.analysis_max_width)
+    buffers = _shape_buffers(frame_buffers, analysis_shape)
+    frame_latest = _resize_if_needed(img_latest, analysis_shape, buffers, "frame_latest")
+    frame_prev = _resize_if_needed(img_prev, analysis_shape, buffers, "frame_prev")
 
-    gray_latest = cv2.cvtColor(img_latest, cv2.COLOR_BGR2GRAY)
-    gray_prev = cv2.cvtColor(img_prev, cv2.COLOR_BGR2GRAY)
+    try:
+        mask_mtime_ns = mask_path.stat().st_mtime_ns
+    except OSError:
+        mask_mtime_ns = 0
+    mask = _cached_mask(str(mask_path), mask_mtime_ns, analysis_shape, settings.mask_inclusive)
+    mask_pixels = int(cv2.countNonZero(mask))
+    apply_mask = mask_pixels < mask.size
 
     ksize = _ensure_odd(settings.blur_kernel)
-    gray_latest = cv2.GaussianBlur(gray_latest, (ksize, ksize), 0)
-    gray_prev = cv2.GaussianBlur(gray_prev, (ksize, ksize), 0)
-
-    diff = cv2.absdiff(gray_latest, gray_prev)
-
-    mask = _load_mask_image(mask_path, diff.shape, inclusive=settings.mask_inclusive)
-    diff = cv2.bitwise_and(diff, diff, mask=mask)
-    _, binary = cv2.threshold(diff, settings.binary_threshold, 255, cv2.THRESH_BINARY)
-
-    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
-    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel)
-    binary = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, kernel)
+    if motion_kernel.enabled():
+        diff = motion_kernel.threshold_diff(
+            frame_latest,
+            frame_prev,
+            ksize,
+            mask,
+            settings.binary_threshold,
+            apply_mask,
+            out=_buffer(buffers, "blur_prev", analysis_shape),
+            row_a=_buffer(buffers, "row_latest", analysis_shape, np.uint16),
+            row_b=_buffer(buffers, "row_prev", analysis_shape, np.uint16),
+        )
+        binary = _buffer(buffers, "blur_latest", analysis_shape)
+        if binary is None:
+            binary = np.empty_like(diff)
+    else:
+        gray_latest = cv2.cvtColor(
+            frame_latest, cv2.COLOR_BGR2GRAY, dst=_buffer(buffers, "gray_latest", analysis_shape)
+        )
+        gray_prev = cv2.cvtColor(frame_prev, cv2.COLOR_BGR2GRAY, dst=_buffer(buffers, "gray_prev", analysis_shape))
+
+        gray_latest = cv2.GaussianBlur(
+            gray_latest, (ksize, ksize), 0, dst=_buffer(buffers, "blur_latest", analysis_shape)
+        )
+        gray_prev = cv2.GaussianBlur(gray_prev, (ksize, ksize), 0, dst=_buffer(buffers, "blur_prev", analysis_shape))
+
+        # 差分以降は2枚のバッファを dst= で使い回し、フレーム毎の中間配列確保を避ける
+        diff = cv2.absdiff(gray_latest, gray_prev, dst=gray_prev)
+        binary = gray_latest
+
+        if apply_mask:
+            # マスクは 0/255 の二値なので min で bitwise_and と同じ結果になる
+            cv2.min(diff, mask, dst=diff)
+        cv2.threshold(diff, settings.binary_threshold, 255, cv2.THRESH_BINARY, dst=diff)
+
+    cv2.morphologyEx(diff, cv2.MORPH_OPEN, _MORPH_KERNEL, dst=binary)
+    cv2.morphologyEx(binary, cv2.MORPH_CLOSE, _MORPH_KERNEL, dst=diff)
+    binary = diff
 
     changed = int(cv2.countNonZero(binary))
-    mask_pixels = int(cv2.countNonZero(mask))
     detection_rate = (changed / mask_pixels) if mask_pixels > 0 else 0.0
 
-    # overlay_color は "#rrggbb" 形式を想定
-    color_tuple = _parse_overlay_color(getattr(settings, "overlay_color", "#ff69b4"))
-    alpha_val = _parse_overlay_alpha(getattr(settings, "overlay_alpha", 0.35))
-    overlay_img = _overlay(img_latest, binary, color=color_tuple, alpha=alpha_val)
-    overlay_path = _overlay_path(latest_path)
-    cv2.imwrite(str(overlay_path), overlay_img)
+    overlay_path: Optional[Path] = None
+    overlay_img: Optional[np.ndarray] = None
+    if changed > 0:
+        # 変化が無ければオーバーレイは元画像と同一になるため、合成と書き込みを省く
+        # overlay_color は "#rrggbb" 形式を想定
+        color_tuple = _parse_overlay_color(getattr(settings, "overlay_color", "#ff69b4"))
+        alpha_val = _parse_overlay_alpha(getattr(settings, "overlay_alpha", 0.35))
+        full_shape = img_latest.shape[:2]
+        if binary.shape != full_shape:
+            binary = cv2.resize(
+                binary,
+                (full_shape[1], full_shape[0]),
+                dst=_buffer(buffers, "binary_full", full_shape),
+                interpolation=cv2.INTER_NEAREST,
+            )
+        overlay_img = _overlay(
+            img_latest,
+            binary,
+            color=color_tuple,
+            alpha=alpha_val,
+            blended=_buffer(buffers, "blended", img_latest.shape),
+        )
+        overlay_path = _overlay_path(latest_path)
 
     alarm = detection_rate >= settings.threshold
 
@@ -144,4 +277,5 @@ def analyze_detection(
         mask_pixels=mask_pixels,
         overlay_path=overlay_path,
         alarm=alarm,
+        overlay_image=overlay_img,
     )
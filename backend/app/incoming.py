@@ -1,6 +1,9 @@
 from __future__ import annotations
 
 import asyncio
+import errno
+import functools
+import os
 import shutil
 import time
 from datetime import datetime, timezone
@@ -13,6 +16,30 @@ from watchdog.observers import Observer
 from .storage import archive_path, ensure_directories
 
 
+@functools.lru_cache(maxsize=8)
+def _ensure_archive_dir(path: Path) -> None:
+    # 日付ディレクトリの mkdir はディレクトリごとに1回で済ませる
+    ensure_directories(path)
+
+
+def _move_file(src: Path, dst: Path) -> Path:
+    """同一ファイルシステムなら os.rename の1回で移動し、別デバイス時のみ shutil.move に落とす。"""
+    try:
+        os.rename(src, dst)
+    except FileNotFoundError:
+        if not src.exists():
+            raise
+        # 日付ディレクトリが外部で削除された場合はキャッシュを破棄して作り直す
+        _ensure_archive_dir.cache_clear()
+        ensure_directories(dst.parent)
+        os.rename(src, dst)
+    except OSError as exc:
+        if exc.errno != errno.EXDEV:
+            raise
+        return Path(shutil.move(str(src), str(dst)))
+    return dst
+
+
 class IncomingProcessor:
     def __init__(self, incoming_root: Path, storage_root: Path, on_processed=None) -> None:
         self.incoming_root = incoming_root
@@ -25,16 +52,16 @@ class IncomingProcessor:
 
         timestamp = datetime.fromtimestamp(path.stat().st_mtime, tz=timezone.utc)
         target = archive_path(self.storage_root, timestamp, path.name)
-        ensure_directories(target.parent)
+        _ensure_archive_dir(target.parent)
 
         try:
-            target = Path(shutil.move(str(path), str(target)))
+            target = _move_file(path, target)
         except (OSError, shutil.Error):
             return None
 
         if self.on_processed:
             try:
-                self.on_processed(timestamp)
+                self.on_processed(timestamp, target)
             except Exception:
                 pass
 
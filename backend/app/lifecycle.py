@@ -1,14 +1,16 @@
 from __future__ import annotations
 
 import asyncio
+import logging
 from contextlib import asynccontextmanager
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 from typing import AsyncIterator
 
-from apscheduler.schedulers.background import BackgroundScheduler
 from fastapi import FastAPI
 
+from . import motion_kernel
+from .alert import SLACK_QUEUE_MAXSIZE, slack_worker
 from .incoming import IncomingProcessor, polling_loop, start_observer
 from .config import (
     Settings,
@@ -19,21 +21,47 @@ from .config import (
     get_storage_root,
     load_settings,
 )
-from .storage import cleanup_older_than, ensure_directories
-
-
-def start_scheduler(storage_root: Path) -> BackgroundScheduler:
-    scheduler = BackgroundScheduler(timezone="UTC")
-    scheduler.add_job(
-        cleanup_older_than,
-        trigger="cron",
-        hour=3,
-        kwargs={"storage_root": storage_root, "retention_days": 90},
-        id="cleanup",
-        replace_existing=True,
-    )
-    scheduler.start()
-    return scheduler
+from .storage import (
+    RECENT_IMAGES_MAXLEN,
+    RecentImageIndex,
+    cleanup_older_than,
+    datetime_to_ns,
+    ensure_directories,
+    scan_recent_images,
+)
+
+
+logger = logging.getLogger(__name__)
+
+CLEANUP_HOUR_UTC = 3
+RETENTION_DAYS = 90
+
+
+def _seconds_until(now: datetime, hour: int) -> float:
+    next_run = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if next_run <= now:
+        next_run += timedelta(days=1)
+    return (next_run - now).total_seconds()
+
+
+async def cleanup_daily_loop(
+    storage_root: Path,
+    stop_event: asyncio.Event,
+    retention_days: int = RETENTION_DAYS,
+) -> None:
+    """毎日 CLEANUP_HOUR_UTC 時に cleanup_older_than をイベントループ外で実行する。"""
+    while not stop_event.is_set():
+        delay = _seconds_until(datetime.now(timezone.utc), CLEANUP_HOUR_UTC)
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=delay)
+            break
+        except asyncio.TimeoutError:
+            pass
+        try:
+            deleted = await asyncio.to_thread(cleanup_older_than, storage_root, retention_days)
+            logger.info("cleanup removed %d files older than %d days", len(deleted), retention_days)
+        except Exception as exc:  # pragma: no cover
+            logger.error("cleanup failed: %s", exc)
 
 
 @asynccontextmanager
@@ -48,9 +76,16 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
 
     ensure_directories(storage_root, incoming_root, logs_root, mask_path.parent)
 
-    scheduler = start_scheduler(storage_root)
-    def _mark_processed(ts):
+    if motion_kernel.enabled():
+        # JIT コンパイルを最初のダッシュボード要求で行わないよう起動時に済ませる
+        await asyncio.to_thread(motion_kernel.warm_up)
+
+    recent_images = RecentImageIndex()
+    recent_images.extend(scan_recent_images(storage_root, RECENT_IMAGES_MAXLEN))
+
+    def _mark_processed(ts, target):
         app.state.last_image_at = ts
+        recent_images.add(datetime_to_ns(ts), target)
 
     processor = IncomingProcessor(
         incoming_root=incoming_root,
@@ -60,18 +95,27 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     observer = start_observer(processor)
     stop_event = asyncio.Event()
     poll_task = asyncio.create_task(polling_loop(processor, stop_event=stop_event))
+    cleanup_task = asyncio.create_task(cleanup_daily_loop(storage_root, stop_event))
+    alert_queue: asyncio.Queue = asyncio.Queue(maxsize=SLACK_QUEUE_MAXSIZE)
+    alert_task = asyncio.create_task(slack_worker(alert_queue))
 
     app.state.settings = settings
+    app.state.settings_path = settings_path
+    app.state.settings_lock = asyncio.Lock()
     app.state.storage_root = storage_root
     app.state.incoming_root = incoming_root
     app.state.logs_root = logs_root
     app.state.mask_path = mask_path
     app.state.started_at = datetime.utcnow().isoformat() + "Z"
-    app.state.scheduler = scheduler
+    app.state.cleanup_task = cleanup_task
     app.state.incoming_observer = observer
     app.state.incoming_poll_task = poll_task
     app.state.incoming_stop_event = stop_event
     app.state.last_image_at = None
+    app.state.recent_images = recent_images
+    app.state.frame_buffers = {}
+    app.state.alert_queue = alert_queue
+    app.state.alert_task = alert_task
 
     try:
         yield
@@ -80,4 +124,9 @@ async def lifespan(app: FastAPI) -> AsyncIterator[None]:
         observer.stop()
         observer.join()
         await poll_task
-        scheduler.shutdown(wait=False)
+        await cleanup_task
+        alert_task.cancel()
+        try:
+            await alert_task
+        except asyncio.CancelledError:
+            pass
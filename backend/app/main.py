@@ -1,16 +1,18 @@
+import asyncio
 from datetime import datetime, timezone
 import shutil
 from pathlib import Path
 from typing import Optional
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from .alert import gpio_high, gpio_low, gpio_setup, send_slack_alert
-from .config import Settings, get_settings_path, load_settings
-from .detection import analyze_detection
+from .alert import enqueue_slack_alert, gpio_high, gpio_low, gpio_setup
+from .config import Settings
+from .detection import analyze_detection, write_overlay
 from .lifecycle import lifespan
-from .storage import list_recent_images
+from .storage import iso_from_mtime_ns, list_recent_image_entries
 from .api import setup_api
 
 
@@ -27,7 +29,12 @@ class DashboardResponse(BaseModel):
     previous_timestamp: Optional[str] = None
 
 
-app = FastAPI(title="Snowjam Detection API", version="0.3.0", lifespan=lifespan)
+app = FastAPI(
+    title="Snowjam Detection API",
+    version="0.3.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 setup_api(app)
 
 
@@ -61,17 +68,19 @@ async def health() -> dict:
     }
 
 
-@app.get("/api/dashboard", response_model=DashboardResponse)
-async def dashboard() -> DashboardResponse:
-    settings_path = get_settings_path()
-    settings: Settings = load_settings(settings_path)
+# DashboardResponse は OpenAPI のスキーマ表示のみに使い、実行時の検証は行わない
+@app.get("/api/dashboard", response_model=None, responses={200: {"model": DashboardResponse}})
+async def dashboard() -> ORJSONResponse:
+    settings: Settings = app.state.settings
     storage_root: Path = app.state.storage_root
     mask_path: Path = app.state.mask_path
     last_image_at = app.state.last_image_at
 
-    recent = list_recent_images(storage_root, limit=2, include_overlays=False)
-    latest = recent[0] if len(recent) > 0 else None
-    previous = recent[1] if len(recent) > 1 else None
+    recent = list_recent_image_entries(
+        storage_root, limit=2, include_overlays=False, recent=app.state.recent_images
+    )
+    latest = recent[0][1] if len(recent) > 0 else None
+    previous = recent[1][1] if len(recent) > 1 else None
 
     detection_rate = 0.0
     overlay_path: Optional[Path] = None
@@ -81,47 +90,64 @@ async def dashboard() -> DashboardResponse:
     prev_ts: Optional[str] = None
 
     if latest:
-        try:
-            latest_ts = datetime.fromtimestamp(latest.stat().st_mtime, tz=timezone.utc).isoformat()
-        except OSError:
-            latest_ts = None
+        latest_ts = iso_from_mtime_ns(recent[0][0])
     if previous:
-        try:
-            prev_ts = datetime.fromtimestamp(previous.stat().st_mtime, tz=timezone.utc).isoformat()
-        except OSError:
-            prev_ts = None
+        prev_ts = iso_from_mtime_ns(recent[1][0])
 
     if latest and previous:
-        result = analyze_detection(latest, previous, settings, mask_path)
+        result = analyze_detection(
+            latest, previous, settings, mask_path, frame_buffers=app.state.frame_buffers
+        )
         if result:
             detection_rate = result.detection_rate
-            overlay_path = result.overlay_path
+            # 変化ゼロでオーバーレイを生成しなかった場合は最新画像そのものを表示する
+            overlay_path = result.overlay_path or latest
+            if overlay_path and result.overlay_image is not None:
+                # PNGエンコードとディスク書き込みはイベントループ外で行う
+                await asyncio.to_thread(write_overlay, overlay_path, result.overlay_image)
             alarm_state = "Alarm" if settings.alarm_enabled and result.alarm else "Normal"
             if settings.alarm_enabled and result.alarm and settings.gpio_pin:
                 gpio_high(settings.gpio_pin)
             if settings.alarm_enabled and result.alarm:
-                send_slack_alert(
+                # 送信はバックグラウンドのワーカーに任せ、ダッシュボードは即時に返す
+                enqueue_slack_alert(
+                    app.state.alert_queue,
                     bot_token=settings.slack_bot_token,
                     webhook_url=settings.slack_webhook_url,
                     channel=settings.slack_channel or None,
                     message=f"[ALARM] detection_rate={detection_rate:.3f} threshold={settings.threshold:.3f}",
                     image_path=overlay_path,
                 )
+        else:
+            # 索引後に削除された画像は索引から外し、次回は残っている画像から選び直す
+            for _, path in recent:
+                if not path.exists():
+                    app.state.recent_images.discard(path)
 
     if settings.delay_monitor_enabled and last_image_at:
         now = datetime.now(timezone.utc)
         delta = (now - last_image_at).total_seconds()
         delay_warning = delta > settings.delay_threshold_seconds
 
-    return DashboardResponse(
-        latest_image=str(latest) if latest else None,
-        previous_image=str(previous) if previous else None,
-        mask_overlay=str(overlay_path) if overlay_path else None,
-        detection_rate=detection_rate,
-        threshold=settings.threshold,
-        alarm_state=alarm_state,
-        delay_warning=delay_warning,
-        logs=[],
-        latest_timestamp=latest_ts,
-        previous_timestamp=prev_ts,
+    # Response を直接返すことで FastAPI 側の再検証と jsonable_encoder を省く
+    return ORJSONResponse(
+        {
+            "latest_image": str(latest) if latest else None,
+            "previous_image": str(previous) if previous else None,
+            "mask_overlay": str(overlay_path) if overlay_path else None,
+            "detection_rate": detection_rate,
+            "threshold": settings.threshold,
+            "alarm_state": alarm_state,
+            "delay_warning": delay_warning,
+            "logs": [],
+            "latest_timestamp": latest_ts,
+            "previous_timestamp": prev_ts,
+        }
     )
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # watchdog/ポーリング/GPIO と app.state をプロセス内で共有するため workers は1固定
+    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import functools
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from .config import get_motion_backend
+
+try:
+    from numba import njit, prange  # type: ignore
+except ImportError:  # pragma: no cover
+    njit = None  # OpenCV のみで処理する
+
+
+# OpenCV のビルド情報でこれらが有効なら、OpenCV の SIMD 実装の方が速い
+_SIMD_FEATURES = frozenset({"SSE2", "NEON"})
+_BUILD_FEATURE_KEYS = ("Baseline", "Dispatched code generation")
+
+
+def _opencv_has_simd(build_info: Optional[str] = None) -> bool:
+    """OpenCV が SSE2/NEON 有効でビルドされているかを返す。
+
+    cv2.checkHardwareSupport は実行中の CPU の対応状況を返すため、x86-64 / AArch64 では
+    常に真になる。ビルド時の設定は getBuildInformation の CPU/HW features から読む。
+    """
+    if not cv2.useOptimized():
+        return False
+    if build_info is None:
+        build_info = cv2.getBuildInformation()
+    for line in build_info.splitlines():
+        key, _, value = line.strip().partition(":")
+        if key in _BUILD_FEATURE_KEYS and _SIMD_FEATURES.intersection(value.split()):
+            return True
+    return False
+
+
+@functools.lru_cache(maxsize=1)
+def enabled() -> bool:
+    """MOTION_BACKEND=auto の場合は SIMD 無しの OpenCV ビルドでのみ Numba を使う。"""
+    backend = get_motion_backend()
+    if njit is None or backend == "opencv":
+        return False
+    if backend == "numba":
+        return True
+    return not _opencv_has_simd()
+
+
+@functools.lru_cache(maxsize=8)
+def _gaussian_weights(ksize: int) -> np.ndarray:
+    # cv2.GaussianBlur(..., sigma=0) と同じ係数
+    return cv2.getGaussianKernel(ksize, 0).ravel().astype(np.float32)
+
+
+# 横方向ぼかしの結果を uint16 の固定小数点 (×256) で保持する。255×256 は uint16 に収まる
+_ROW_SCALE = 256.0
+
+
+if njit is not None:
+
+    @njit(cache=True, inline="always")
+    def _reflect101(i, n):
+        # OpenCV 既定の BORDER_REFLECT_101
+        if n == 1:
+            return 0
+        while i < 0 or i >= n:
+            if i < 0:
+                i = -i
+            if i >= n:
+                i = 2 * n - 2 - i
+        return i
+
+    @njit(cache=True, inline="always")
+    def _gray(bgr, y, x):
+        return np.floor(0.114 * bgr[y, x, 0] + 0.587 * bgr[y, x, 1] + 0.299 * bgr[y, x, 2] + 0.5)
+
+    @njit(parallel=True, cache=True, fastmath=True)
+    def _motion_kernel(bgr_a, bgr_b, weights, mask, bin_thresh, apply_mask, row_a, row_b, out):
+        h, w = out.shape
+        r = weights.shape[0] // 2
+
+        # グレースケール化 + 横方向のぼかし
+        for y in prange(h):
+            for x in range(w):
+                sa = 0.0
+                sb = 0.0
+                for k in range(-r, r + 1):
+                    xx = _reflect101(x + k, w)
+                    sa += weights[k + r] * _gray(bgr_a, y, xx)
+                    sb += weights[k + r] * _gray(bgr_b, y, xx)
+                row_a[y, x] = np.uint16(np.floor(sa * _ROW_SCALE + 0.5))
+                row_b[y, x] = np.uint16(np.floor(sb * _ROW_SCALE + 0.5))
+
+        # 縦方向のぼかし → 差分 → マスク → 二値化
+        for y in prange(h):
+            for x in range(w):
+                if apply_mask and mask[y, x] == 0:
+                    out[y, x] = 0
+                    continue
+                sa = 0.0
+                sb = 0.0
+                for k in range(-r, r + 1):
+                    yy = _reflect101(y + k, h)
+                    sa += weights[k + r] * row_a[yy, x]
+                    sb += weights[k + r] * row_b[yy, x]
+                d = abs(np.floor(sa / _ROW_SCALE + 0.5) - np.floor(sb / _ROW_SCALE + 0.5))
+                out[y, x] = 255 if d > bin_thresh else 0
+
+
+def threshold_diff(
+    frame_a: np.ndarray,
+    frame_b: np.ndarray,
+    ksize: int,
+    mask: np.ndarray,
+    bin_thresh: int,
+    apply_mask: bool,
+    out: Optional[np.ndarray] = None,
+    row_a: Optional[np.ndarray] = None,
+    row_b: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """グレースケール化・ぼかし・差分・マスク・二値化を2パスのカーネルで行う。
+
+    row_a / row_b は uint16 の作業バッファ。呼び出し側で保持すれば毎回の確保を避けられる。
+    """
+    shape = frame_a.shape[:2]
+    if out is None:
+        out = np.empty(shape, dtype=np.uint8)
+    if row_a is None:
+        row_a = np.empty(shape, dtype=np.uint16)
+    if row_b is None:
+        row_b = np.empty(shape, dtype=np.uint16)
+    _motion_kernel(
+        frame_a, frame_b, _gaussian_weights(ksize), mask, bin_thresh, apply_mask, row_a, row_b, out
+    )
+    return out
+
+
+def warm_up() -> None:
+    """初回の JIT コンパイルを起動時に済ませる。マスクは実運用と同じく読み取り専用で渡す。"""
+    frame = np.zeros((8, 8, 3), dtype=np.uint8)
+    mask = np.full((8, 8), 255, dtype=np.uint8)
+    mask.setflags(write=False)
+    threshold_diff(frame, frame, 3, mask, 0, True)
@@ -1,8 +1,17 @@
 from __future__ import annotations
 
+import bisect
+import functools
+import os
+import shutil
+import threading
 from datetime import datetime, timedelta, timezone
+from operator import itemgetter
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator, Optional
+
+# 取り込み済み画像 (mtime_ns, path) のインメモリ索引の最大件数
+RECENT_IMAGES_MAXLEN = 256
 
 
 def ensure_directories(*paths: Path) -> None:
@@ -10,43 +19,247 @@ def ensure_directories(*paths: Path) -> None:
         path.mkdir(parents=True, exist_ok=True)
 
 
+def archive_dir(storage_root: Path, timestamp: datetime) -> Path:
+    return storage_root / f"{timestamp:%Y}" / f"{timestamp:%m}" / f"{timestamp:%d}"
+
+
 def archive_path(storage_root: Path, timestamp: datetime, filename: str) -> Path:
-    date_dir = storage_root / f"{timestamp:%Y}" / f"{timestamp:%m}" / f"{timestamp:%d}"
-    return date_dir / filename
+    return archive_dir(storage_root, timestamp) / filename
+
+
+class RecentImageIndex:
+    """取り込み済み画像を mtime 昇順で保持するインメモリ索引。
+
+    障害復旧後にカメラが古い画像をまとめて再送しても最新の画像が押し出されないよう、
+    挿入順ではなく mtime の古いものから捨てる。ウォッチャーのスレッドとイベントループの
+    両方から更新されるためロックで保護する。
+    """
+
+    def __init__(self, maxlen: int = RECENT_IMAGES_MAXLEN) -> None:
+        self.maxlen = maxlen
+        self._entries: list[tuple[int, Path]] = []
+        self._mtimes: dict[Path, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, mtime_ns: int, path: Path) -> None:
+        with self._lock:
+            self._remove(path)
+            bisect.insort(self._entries, (mtime_ns, path))
+            self._mtimes[path] = mtime_ns
+            overflow = len(self._entries) - self.maxlen
+            if overflow > 0:
+                for _, old in self._entries[:overflow]:
+                    del self._mtimes[old]
+                del self._entries[:overflow]
+
+    def extend(self, entries: Iterable[tuple[int, Path]]) -> None:
+        for mtime_ns, path in entries:
+            self.add(mtime_ns, path)
+
+    def discard(self, path: Path) -> None:
+        with self._lock:
+            self._remove(path)
+
+    def newest(self, limit: int) -> list[tuple[int, Path]]:
+        """新しい順に最大 limit 件を返す。"""
+        if limit <= 0:
+            return []
+        with self._lock:
+            return self._entries[: -limit - 1 : -1]
+
+    def _remove(self, path: Path) -> None:
+        mtime_ns = self._mtimes.pop(path, None)
+        if mtime_ns is None:
+            return
+        index = bisect.bisect_left(self._entries, (mtime_ns, path))
+        del self._entries[index]
+
+
+def datetime_to_ns(timestamp: datetime) -> int:
+    return (timestamp - datetime(1970, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1) * 1000
+
+
+@functools.lru_cache(maxsize=1024)
+def iso_from_mtime_ns(mtime_ns: int) -> str:
+    seconds, nanos = divmod(mtime_ns, 1_000_000_000)
+    timestamp = datetime.fromtimestamp(seconds, tz=timezone.utc) + timedelta(microseconds=nanos // 1000)
+    return timestamp.isoformat()
 
 
 def cleanup_older_than(storage_root: Path, retention_days: int = 90) -> list[Path]:
-    """Delete files older than retention_days. Returns list of deleted paths."""
+    """Delete files older than retention_days. Returns list of deleted files.
+
+    The archive is laid out as YYYY/MM/DD, so date directories entirely before the
+    cutoff day are removed wholesale and the boundary day is checked per file.
+    Day directories after the cutoff are skipped; loose files at the year/month
+    levels and anything under non-date directories are still judged by mtime.
+    """
     now = datetime.now(timezone.utc)
     cutoff = now - timedelta(days=retention_days)
+    cutoff_ts = cutoff.timestamp()
+    boundary = (cutoff.year, cutoff.month, cutoff.day)
     deleted: list[Path] = []
 
     if not storage_root.exists():
         return deleted
 
-    for path in storage_root.rglob("*"):
-        if not path.is_file():
-            continue
+    def _list(directory: Path) -> list[os.DirEntry]:
+        try:
+            with os.scandir(directory) as it:
+                return list(it)
+        except OSError:
+            return []
+
+    def _delete_if_old(entry: os.DirEntry) -> None:
         try:
-            stat = path.stat()
-            mtime = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
-            if mtime < cutoff:
+            if entry.is_file() and entry.stat().st_mtime < cutoff_ts:
+                path = Path(entry.path)
                 path.unlink(missing_ok=True)
                 deleted.append(path)
         except OSError:
-            continue
+            pass
+
+    def _list_files(directory: Path) -> list[Path]:
+        # 件数を数えるだけなので stat は取らない
+        files: list[Path] = []
+        for entry in _list(directory):
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    files.extend(_list_files(Path(entry.path)))
+                else:
+                    files.append(Path(entry.path))
+            except OSError:
+                continue
+        return files
+
+    def _remove_tree(directory: Path) -> None:
+        files = _list_files(directory)
+        shutil.rmtree(directory, ignore_errors=True)
+        if directory.exists():
+            # 一部が消せなかった場合は実際に無くなったファイルだけを数える
+            files = [path for path in files if not os.path.lexists(path)]
+        deleted.extend(files)
+
+    def _prune_by_mtime(directory: Path) -> None:
+        # 日付構造外のディレクトリはファイル単位で mtime 判定する
+        for entry in _list(directory):
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if is_dir:
+                _prune_by_mtime(Path(entry.path))
+            else:
+                _delete_if_old(entry)
 
+    def _walk(directory: Path, prefix: tuple[int, ...], on_boundary: bool) -> None:
+        depth = len(prefix)
+        for entry in _list(directory):
+            path = Path(entry.path)
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+            except OSError:
+                continue
+            if not is_dir:
+                _delete_if_old(entry)
+                continue
+            if depth >= len(boundary):
+                _prune_by_mtime(path)
+                continue
+            try:
+                key = prefix + (int(entry.name),)
+            except ValueError:
+                _prune_by_mtime(path)
+                continue
+            is_day = depth + 1 == len(boundary)
+            if not on_boundary or key > boundary[: depth + 1]:
+                # カットオフより新しい日付ディレクトリの中身は新しいため走査しない
+                if not is_day:
+                    _walk(path, key, on_boundary=False)
+            elif key < boundary[: depth + 1]:
+                _remove_tree(path)
+            else:
+                _walk(path, key, on_boundary=True)
+
+    _walk(storage_root, (), on_boundary=True)
     return deleted
 
 
-def list_recent_images(storage_root: Path, limit: int = 2, include_overlays: bool = False) -> list[Path]:
+def is_overlay(path: Path) -> bool:
+    return "_mask" in path.name
+
+
+def _scan_files(directory: Path) -> Iterator[tuple[int, Path]]:
+    """scandir で配下のファイルを (mtime_ns, path) で列挙する。DirEntry の stat を再利用する。"""
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        yield from _scan_files(Path(entry.path))
+                    elif entry.is_file():
+                        yield entry.stat().st_mtime_ns, Path(entry.path)
+                except OSError:
+                    continue
+    except OSError:
+        return
+
+
+def _subdirs_newest_first(directory: Path) -> list[Path]:
+    try:
+        with os.scandir(directory) as it:
+            names = [entry.name for entry in it if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return []
+    # YYYY/MM/DD はゼロ埋めなので名前の降順がそのまま新しい順になる
+    return [directory / name for name in sorted(names, reverse=True)]
+
+
+def scan_recent_images(
+    storage_root: Path, limit: int, include_overlays: bool = False
+) -> list[tuple[int, Path]]:
+    """日付ディレクトリを新しい順に走査し、limit 件集まった日で打ち切る。"""
+    entries: list[tuple[int, Path]] = []
+    for year_dir in _subdirs_newest_first(storage_root):
+        for month_dir in _subdirs_newest_first(year_dir):
+            for day_dir in _subdirs_newest_first(month_dir):
+                for mtime, path in _scan_files(day_dir):
+                    if include_overlays or not is_overlay(path):
+                        entries.append((mtime, path))
+                if len(entries) >= limit:
+                    entries.sort(key=itemgetter(0), reverse=True)
+                    return entries[:limit]
+    entries.sort(key=itemgetter(0), reverse=True)
+    return entries
+
+
+def list_recent_image_entries(
+    storage_root: Path,
+    limit: int = 2,
+    include_overlays: bool = False,
+    recent: Optional[RecentImageIndex] = None,
+) -> list[tuple[int, Path]]:
+    """新しい順に (mtime_ns, path) を返す。"""
     if not storage_root.exists():
         return []
-    def _is_overlay(p: Path) -> bool:
-        return "_mask" in p.name
-
-    files: Iterable[Path] = (p for p in storage_root.rglob("*") if p.is_file())
-    if not include_overlays:
-        files = (p for p in files if not _is_overlay(p))
-    sorted_files = sorted(files, key=lambda p: p.stat().st_mtime, reverse=True)
-    return sorted_files[:limit]
+
+    # オーバーレイは索引に載らないため、除外時のみ索引から返す
+    if recent is not None and not include_overlays:
+        entries = recent.newest(limit)
+        if len(entries) >= limit:
+            return entries
+
+    return scan_recent_images(storage_root, limit, include_overlays)
+
+
+def list_recent_images(
+    storage_root: Path,
+    limit: int = 2,
+    include_overlays: bool = False,
+    recent: Optional[RecentImageIndex] = None,
+) -> list[Path]:
+    entries = list_recent_image_entries(storage_root, limit, include_overlays, recent)
+    return [path for _, path in entries]
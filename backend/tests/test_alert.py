@@ -0,0 +1,49 @@
+from __future__ import annotations
+
+import asyncio
+
+import pytest
+
+from app import alert
+
+
+def _run_worker(alerts: list[dict], dedupe_seconds: float, monkeypatch: pytest.MonkeyPatch) -> list[str]:
+    sent: list[str] = []
+    monkeypatch.setattr(alert, "send_slack_alert", lambda **kwargs: sent.append(kwargs["message"]))
+
+    async def _main() -> None:
+        queue: asyncio.Queue = asyncio.Queue()
+        worker = asyncio.create_task(alert.slack_worker(queue, dedupe_seconds))
+        for item in alerts:
+            alert.enqueue_slack_alert(queue, **item)
+        await queue.join()
+        worker.cancel()
+
+    asyncio.run(_main())
+    return sent
+
+
+def test_slack_worker_dedupes_repeated_messages(monkeypatch: pytest.MonkeyPatch) -> None:
+    sent = _run_worker(
+        [{"message": "a"}, {"message": "a"}, {"message": "b"}, {"message": "a"}],
+        dedupe_seconds=30.0,
+        monkeypatch=monkeypatch,
+    )
+
+    assert sent == ["a", "b"]
+
+
+def test_slack_worker_resends_after_dedupe_window(monkeypatch: pytest.MonkeyPatch) -> None:
+    sent = _run_worker([{"message": "a"}, {"message": "a"}], dedupe_seconds=0.0, monkeypatch=monkeypatch)
+
+    assert sent == ["a", "a"]
+
+
+def test_enqueue_drops_alert_when_queue_is_full() -> None:
+    async def _main() -> tuple[bool, bool, int]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        first = alert.enqueue_slack_alert(queue, message="a")
+        second = alert.enqueue_slack_alert(queue, message="b")
+        return first, second, queue.qsize()
+
+    assert asyncio.run(_main()) == (True, False, 1)
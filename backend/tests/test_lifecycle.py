@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+from datetime import datetime, timezone
+
+import pytest
+
+from app.lifecycle import _seconds_until
+
+
+@pytest.mark.parametrize(
+    ("now", "expected"),
+    [
+        (datetime(2024, 1, 1, 1, 30, tzinfo=timezone.utc), 90 * 60),
+        (datetime(2024, 1, 1, 3, 0, tzinfo=timezone.utc), 24 * 3600),
+        (datetime(2024, 1, 1, 3, 0, 1, tzinfo=timezone.utc), 24 * 3600 - 1),
+        (datetime(2024, 12, 31, 23, 0, tzinfo=timezone.utc), 4 * 3600),
+    ],
+)
+def test_seconds_until_next_cleanup_hour(now: datetime, expected: float) -> None:
+    assert _seconds_until(now, 3) == expected
@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import cv2
+import numpy as np
+import pytest
+
+from app import motion_kernel
+
+SIMD_BUILD = """
+  CPU/HW features:
+    Baseline:                    SSE SSE2 SSE3
+      requested:                 SSE3
+    Dispatched code generation:  SSE4_1 AVX2
+"""
+
+NO_SIMD_BUILD = """
+  CPU/HW features:
+    Baseline:
+      requested:                 DETECT
+"""
+
+
+def test_simd_detection_reads_build_information() -> None:
+    assert motion_kernel._opencv_has_simd(SIMD_BUILD)
+    assert motion_kernel._opencv_has_simd(SIMD_BUILD.replace("SSE SSE2 SSE3", "NEON FP16"))
+    assert not motion_kernel._opencv_has_simd(NO_SIMD_BUILD)
+
+
+def _frames(shape: tuple[int, int]) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(0)
+    base = cv2.GaussianBlur(rng.integers(0, 256, (*shape, 3), dtype=np.uint8), (9, 9), 0)
+    moved = base.copy()
+    cv2.rectangle(moved, (20, 15), (70, 50), (255, 255, 255), -1)
+    noise = rng.integers(-6, 7, moved.shape)
+    return base, np.clip(moved.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def _opencv_chain(a, b, ksize, mask, bin_thresh, apply_mask):
+    gray_a = cv2.GaussianBlur(cv2.cvtColor(a, cv2.COLOR_BGR2GRAY), (ksize, ksize), 0)
+    gray_b = cv2.GaussianBlur(cv2.cvtColor(b, cv2.COLOR_BGR2GRAY), (ksize, ksize), 0)
+    diff = cv2.absdiff(gray_a, gray_b)
+    if apply_mask:
+        diff = cv2.min(diff, mask)
+    return cv2.threshold(diff, bin_thresh, 255, cv2.THRESH_BINARY)[1]
+
+
+@pytest.mark.parametrize("ksize", [3, 5])
+@pytest.mark.parametrize("apply_mask", [False, True])
+def test_numba_kernel_matches_opencv_chain(ksize: int, apply_mask: bool) -> None:
+    if motion_kernel.njit is None:
+        pytest.skip("numba is not installed")
+    shape = (60, 90)
+    frame_a, frame_b = _frames(shape)
+    mask = np.zeros(shape, dtype=np.uint8)
+    mask[:, 10:45] = 255
+
+    expected = _opencv_chain(frame_a, frame_b, ksize, mask, 25, apply_mask)
+    actual = motion_kernel.threshold_diff(frame_a, frame_b, ksize, mask, 25, apply_mask)
+
+    # 丸めの差で閾値付近の画素がわずかに入れ替わることのみ許容する
+    mismatched = int(np.count_nonzero(actual != expected))
+    assert mismatched <= expected.size // 500
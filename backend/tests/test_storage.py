@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from app import storage
+from app.storage import (
+    RecentImageIndex,
+    archive_dir,
+    archive_path,
+    cleanup_older_than,
+    list_recent_image_entries,
+    scan_recent_images,
+)
+
+RETENTION_DAYS = 90
+
+
+def _touch(path: Path, timestamp: datetime) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x")
+    os.utime(path, (timestamp.timestamp(), timestamp.timestamp()))
+    return path
+
+
+def _archived(root: Path, timestamp: datetime, name: str) -> Path:
+    return _touch(archive_path(root, timestamp, name), timestamp)
+
+
+def test_cleanup_boundary_day_is_judged_per_file(tmp_path: Path) -> None:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+    old = _archived(tmp_path, cutoff - timedelta(minutes=5), "old.jpg")
+    new = _archived(tmp_path, cutoff + timedelta(minutes=5), "new.jpg")
+
+    deleted = cleanup_older_than(tmp_path, RETENTION_DAYS)
+
+    assert not old.exists()
+    assert new.exists()
+    assert new not in deleted
+
+
+def test_cleanup_removes_expired_month_and_year_wholesale(tmp_path: Path) -> None:
+    cutoff = datetime.now(timezone.utc) - timedelta(days=RETENTION_DAYS)
+    month_old = cutoff - timedelta(days=40)
+    year_old = cutoff - timedelta(days=400)
+    month_file = _archived(tmp_path, month_old, "a.jpg")
+    year_files = [_archived(tmp_path, year_old, f"b{i}.jpg") for i in range(3)]
+    recent = _archived(tmp_path, datetime.now(timezone.utc), "recent.jpg")
+
+    deleted = cleanup_older_than(tmp_path, RETENTION_DAYS)
+
+    month_dir = archive_dir(tmp_path, month_old).parent
+    year_dir = archive_dir(tmp_path, year_old).parent.parent
+    assert not month_dir.exists()
+    assert not year_dir.exists()
+    assert sorted(deleted) == sorted([month_file, *year_files])
+    assert recent.exists()
+
+
+def test_cleanup_prunes_non_date_directories_and_loose_files(tmp_path: Path) -> None:
+    now = datetime.now(timezone.utc)
+    expired = now - timedelta(days=RETENTION_DAYS + 30)
+    manual_old = _touch(tmp_path / "manual" / "nested" / "old.jpg", expired)
+    manual_new = _touch(tmp_path / "manual" / "new.jpg", now)
+    loose_old = _touch(tmp_path / f"{now:%Y}" / "stray.jpg", expired)
+    root_old = _touch(tmp_path / "stray.jpg", expired)
+
+    deleted = cleanup_older_than(tmp_path, RETENTION_DAYS)
+
+    assert not manual_old.exists()
+    assert not loose_old.exists()
+    assert not root_old.exists()
+    assert manual_new.exists()
+    assert set(deleted) >= {manual_old, loose_old, root_old}
+
+
+def test_recent_index_keeps_newest_after_backlog_upload(tmp_path: Path) -> None:
+    index = RecentImageIndex(maxlen=256)
+    newest = tmp_path / "newest.jpg"
+    index.add(10_000, newest)
+    # 障害復旧後に古い画像がまとめて届いても最新の画像は残る
+    for i in range(300):
+        index.add(1_000 + i, tmp_path / f"backlog{i}.jpg")
+
+    entries = list_recent_image_entries(tmp_path, limit=2, recent=index)
+
+    assert len(index) == 256
+    assert [path for _, path in entries] == [newest, tmp_path / "backlog299.jpg"]
+
+
+def test_recent_index_replaces_duplicate_paths(tmp_path: Path) -> None:
+    index = RecentImageIndex()
+    a, b = tmp_path / "a.jpg", tmp_path / "b.jpg"
+    index.add(1, a)
+    index.add(2, b)
+    index.add(3, a)
+
+    assert index.newest(5) == [(3, a), (2, b)]
+
+
+def test_recent_index_falls_back_to_scan_after_discard(tmp_path: Path) -> None:
+    now = datetime.now(timezone.utc)
+    first = _archived(tmp_path, now - timedelta(minutes=2), "first.jpg")
+    second = _archived(tmp_path, now - timedelta(minutes=1), "second.jpg")
+    gone = tmp_path / "gone.jpg"
+    index = RecentImageIndex()
+    index.extend([(1, first), (2, second), (3, gone)])
+
+    index.discard(gone)
+    index.discard(second)
+    entries = list_recent_image_entries(tmp_path, limit=2, recent=index)
+
+    assert [path for _, path in entries] == [second, first]
+
+
+def test_scan_walks_newest_day_first_and_stops_early(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # 日付をまたがないよう正午を基準にする
+    now = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    old = _archived(tmp_path, now - timedelta(days=400), "old.jpg")
+    yesterday = _archived(tmp_path, now - timedelta(days=1), "yesterday.jpg")
+    latest = _archived(tmp_path, now, "latest.jpg")
+    earlier = _archived(tmp_path, now - timedelta(seconds=30), "earlier.jpg")
+    _archived(tmp_path, now + timedelta(seconds=1), "latest_mask.png")
+
+    visited: list[Path] = []
+    scan_files = storage._scan_files
+
+    def _recording_scan(directory: Path):
+        visited.append(directory)
+        return scan_files(directory)
+
+    monkeypatch.setattr(storage, "_scan_files", _recording_scan)
+    entries = scan_recent_images(tmp_path, limit=2)
+
+    assert [path for _, path in entries] == [latest, earlier]
+    assert visited == [latest.parent]
+    assert [path for _, path in scan_recent_images(tmp_path, limit=10)] == [latest, earlier, yesterday, old]
+
+
+def test_scan_counts_names_ending_in_mask_as_images(tmp_path: Path) -> None:
+    now = datetime.now(timezone.utc).replace(hour=12, minute=0, second=0, microsecond=0)
+    snow = _archived(tmp_path, now, "snowmask.png")
+    frame = _archived(tmp_path, now - timedelta(seconds=1), "frame.jpg")
+    _archived(tmp_path, now + timedelta(seconds=1), "frame_mask.png")
+
+    entries = list_recent_image_entries(tmp_path, limit=2)
+
+    assert [path for _, path in entries] == [snow, frame]